@@ -0,0 +1,54 @@
+"""Benchmark for StudyBuddy PDF exports: latin-1 core fonts vs the embedded Unicode TTF font.
+
+Repeat exports reuse the cut-down font files, but each document still parses them.
+
+Run from the app directory:  python benchmarks/pdf_export_benchmark.py [sections]
+"""
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from documents import PDFFontCache, PDFRenderer  # noqa: E402
+
+
+SECTION = """# Thermodynamics – “Key” ideas
+## Entropy
+- Entropy ΔS ≥ 0 for an isolated system… see § 4.2
+- Efficiency η = 1 − T₂/T₁ → always < 100%
+### Worked example
+1. Café naïve résumé: the coefficient α ≈ 3×10⁻⁵ per °C
+**Remember:** the second law gives the direction of spontaneous change, and the Carnot cycle sets the upper bound on efficiency.
+A plain paragraph of explanatory text, the kind that makes up most of a generated study guide, long enough to wrap over several lines of the page.
+"""
+
+
+def export(content: str, unicode_font: bool):
+    start = time.perf_counter()
+    pdf_bytes = PDFRenderer.generate_pdf_bytes(content, "Thermodynamics", "Study Guide", unicode_font=unicode_font)
+    return time.perf_counter() - start, len(pdf_bytes)
+
+
+def main():
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    content = SECTION * sections
+    fonts = PDFFontCache.instance()
+    if not fonts.available:
+        print("No Unicode font found; only the latin-1 path can be measured")
+
+    runs = [("latin-1 core fonts", False)]
+    if fonts.available:
+        runs += [("unicode TTF (first export)", True), ("unicode TTF (repeat exports)", True)]
+    for label, unicode_font in runs:
+        elapsed, size = export(content, unicode_font)
+        if label.endswith("exports)"):
+            elapsed = min(elapsed, *(export(content, unicode_font)[0] for _ in range(4)))
+        print(f"{label:28s} {elapsed * 1000:8.1f} ms  {size / 1024:8.1f} KB")
+    if fonts.available:
+        print(f"font cache: {fonts.snapshot()}")
+
+
+if __name__ == "__main__":
+    main()
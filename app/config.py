@@ -0,0 +1,141 @@
+"""Settings shared by the Streamlit app and the document export workers."""
+import os
+
+
+# ============================================
+# CONSTANTS & CONFIGURATION
+# ============================================
+class AppConfig:
+    PRIMARY_COLOR = "#4F46E5"
+    SECONDARY_COLOR = "#10B981"
+    ACCENT_COLOR = "#F59E0B"
+    LIGHT_GRAY = "#F3F4F6"
+    DARK_GRAY = "#6B7280"
+    WHITE = "#FFFFFF"
+    ERROR_COLOR = "#EF4444"
+    SUCCESS_COLOR = "#10B981"
+    WARNING_COLOR = "#F59E0B"
+    
+    API_URL = "https://api.groq.com/openai/v1/chat/completions"
+    API_KEY = "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"
+    
+    DEFAULT_MODEL = "llama-3.3-70b-versatile"
+    MAX_TOKENS = 4000
+    TEMPERATURE = 0.7
+
+    # Token budgets
+    MODEL_CONTEXT_WINDOWS = {            # Prompt plus completion tokens each model accepts
+        "llama-3.3-70b-versatile": 131072,
+        "llama3-8b-8192": 8192,
+        "mixtral-8x7b-32768": 32768,
+        "gemma-7b-it": 8192,
+    }
+    DEFAULT_CONTEXT_WINDOW = 8192
+    CHAT_INPUT_BUDGET = 3000             # Prompt tokens assembled for one QueryBot turn
+    CHAT_MIN_PART_TOKENS = 100           # Smallest remainder worth filling with another context part
+    CHAT_MIN_COMPLETION_TOKENS = 256     # Floor for max_tokens when the prompt nearly fills the window
+
+    # HTTP connection pool (shared by every session in the process)
+    HTTP_POOL_CONNECTIONS = 4      # Distinct hosts kept in the pool manager
+    HTTP_POOL_MAXSIZE = 32         # Keep-alive connections per host
+    HTTP_KEEP_ALIVE = True         # Enable TCP keep-alive probes on pooled sockets
+    CONNECT_TIMEOUT = 5            # Seconds to establish TCP+TLS
+    READ_TIMEOUT = 30              # Seconds to wait between response bytes
+
+    # Streaming
+    STREAM_RESPONSES = True        # Render QueryBot replies token by token
+    STREAM_RENDER_INTERVAL = 0.05  # Minimum seconds between bubble redraws
+    CHAT_PAGE_SIZE = 30            # Messages shown at first and added by each "load earlier"
+
+    # Response cache
+    CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_TTL = 24 * 60 * 60    # Seconds before a cached completion expires
+    RESPONSE_CACHE_MAX_ENTRIES = 5000    # Rows kept on disk before LRU eviction
+    RESPONSE_CACHE_MEMORY_ENTRIES = 256  # Hot entries kept in the in-memory LRU
+
+    # Semantic (near-duplicate) question cache for QueryBot
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_THRESHOLD = 0.8       # Minimum Jaccard similarity of content words
+    SEMANTIC_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds before a stored answer is no longer reused
+    SEMANTIC_CACHE_MAX_ENTRIES = 5000    # Answers kept before the oldest are removed
+
+    # Question bank (validated quiz questions reused across quizzes)
+    QUESTION_BANK_ENABLED = True
+    QUESTION_BANK_MAX_ENTRIES = 20000    # Questions kept before the oldest are removed
+
+    # Rate limiting & retries (header values from the API override these at runtime)
+    RATE_LIMIT_RPM = 30                  # Requests per minute
+    RATE_LIMIT_TPM = 12000               # Tokens per minute
+    EXPECTED_COMPLETION_TOKENS = 800     # Reserved per call until actual usage is known
+    MAX_RETRIES = 4
+    RETRY_BASE_DELAY = 1.0               # Seconds, doubled per attempt with full jitter
+    RETRY_MAX_DELAY = 30.0
+    MAX_QUEUE_WAIT = 120.0               # Seconds a call may wait for capacity before failing
+
+    # Concurrent AI calls
+    AI_MAX_CONCURRENCY = 8               # Worker threads shared by all sessions
+    AI_CALL_DEADLINE = 90.0              # Default seconds before a gathered call is abandoned
+
+    # Quiz generation
+    QUIZ_CHUNK_SIZE = 5                  # Questions requested per parallel completion
+    QUIZ_GENERATION_ROUNDS = 2           # First pass plus one retry round for failed chunks / duplicates
+    QUIZ_DUPLICATE_THRESHOLD = 0.8       # Word-overlap similarity above which questions are duplicates
+    QUIZ_PROGRESSIVE = True              # Start the quiz as soon as the first question has streamed in
+    QUIZ_POLL_INTERVAL = 1.0             # Seconds between checks for newly streamed questions
+    QUIZ_SECTION_CHARS = 2500            # Largest slice of study material sent in one quiz prompt
+    QUIZ_MAX_SECTION_CALLS = 8           # Sections sampled per round when quizzing on a whole material
+
+    # Study material generation budgets (max_tokens per completion)
+    STUDY_MAX_TOKENS = {"Concise": 600, "Moderate": 1500, "Detailed": 2500, "Comprehensive": 3200}
+    STUDY_LENGTH_HINTS = {"Concise": "under 400 words", "Moderate": "about 1000 words",
+                          "Detailed": "about 1800 words", "Comprehensive": "as long as the topic needs"}
+    STUDY_EXAMPLES_TOKENS = 500          # Extra budget when examples are requested
+    STUDY_DIAGRAMS_TOKENS = 300          # Extra budget when diagram suggestions are requested
+    STUDY_OUTLINE_TOKENS = 300           # Budget for the outline of sectioned materials
+    STUDY_SECTION_MAX_TOKENS = 1500      # Budget for each section of sectioned materials
+
+    # Conversation summary
+    CHAT_SUMMARY_TRIGGER_CHARS = 6000    # Unsummarized chat text that triggers a background summary update
+    CHAT_SUMMARY_CHUNK_CHARS = 8000      # Largest slice of new turns sent in one summary prompt
+    CHAT_SUMMARY_TOKENS = 500            # Budget for the summary and for each chunk's notes
+    CHAT_SUMMARY_MAX_WORDS = 250
+
+    # Retrieval over earlier turns and study material for QueryBot
+    CHAT_RETRIEVAL_ENABLED = True
+    CHAT_RETRIEVAL_TOP_K = 3             # Passages offered to the context budget per question
+    CHAT_RETRIEVAL_PASSAGE_CHARS = 1200  # Longest indexed passage; longer messages are split at headings/paragraphs
+    CHAT_RETRIEVAL_RESERVE_TOKENS = 600  # Input budget earlier turns leave for retrieved passages
+
+    # Sectioned study materials
+    STUDY_SECTIONED_LEVELS = ("Comprehensive",)  # Detail levels generated as an outline plus concurrent sections
+    STUDY_OUTLINE_SECTIONS = 6           # Sections requested in the outline
+    STUDY_OUTLINE_MAX_SECTIONS = 10      # Sections kept if the outline comes back longer
+    STUDY_POLL_INTERVAL = 1.0            # Seconds between checks for newly finished sections
+
+    # Document exports
+    EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Rendered PDFs kept in memory across reruns and sessions
+    EXPORT_FILE_THRESHOLD = 200_000      # Characters of content above which PDFs are kept on disk, not in the export cache
+    EXPORT_DISK_MAX_BYTES = 512 * 1024 * 1024  # On-disk exports kept before the oldest are removed
+    EXPORT_WORKERS = 2                   # Worker processes rendering documents; 0 renders on the script thread
+    EXPORT_POLL_INTERVAL = 1.0           # Seconds between checks on a document being rendered
+    PDF_UNICODE_FONTS = True             # Embed a TTF font so Greek, maths and accented text survive export
+    PDF_FONT_FAMILY = "DejaVu"
+    PDF_FONT_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf", "I": "DejaVuSans-Oblique.ttf",
+                      "BI": "DejaVuSans-BoldOblique.ttf"}  # Bundled in static/fonts
+    PDF_FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "fonts")
+    PDF_SYSTEM_FONT_DIRS = ("/usr/share/fonts/truetype/dejavu", "/usr/share/fonts/dejavu", "/usr/local/share/fonts")
+    PDF_FONT_UNICODE_RANGES = (          # Blocks kept in the working copy of the font; anything else is transliterated
+        (0x0020, 0x024F),                # Latin, Latin-1 and Latin Extended
+        (0x0370, 0x03FF),                # Greek
+        (0x0400, 0x04FF),                # Cyrillic
+        (0x2000, 0x23FF),                # Punctuation, super/subscripts, currency, arrows, maths, technical
+        (0x25A0, 0x25FF),                # Geometric shapes (bullets)
+    )
+
+    # Batch study materials
+    BATCH_MAX_ITEMS = 50                 # Topics accepted from one uploaded list
+    BATCH_MAX_IN_FLIGHT = 4              # Items generating at once per batch; the rest wait their turn
+    BATCH_ITEM_DEADLINE = 180.0          # Seconds before a batch item's AI call is given up (includes rate-limit waits)
+    BATCH_POLL_INTERVAL = 1.0            # Seconds between progress updates while a batch runs
+    BATCH_ARCHIVE_TTL = 24 * 60 * 60     # Seconds before an abandoned batch archive is deleted
@@ -0,0 +1,14 @@
+"""Entry point for rendering documents in the export process pool.
+
+The renderers live in ``documents``, which does not import Streamlit, so a
+worker loads only the markdown and PDF code and never the app's page module.
+"""
+import importlib
+
+
+def render(renderer: str, *args):
+    """Call a renderer such as ``"PDFRenderer.generate_pdf_bytes"`` from the documents module"""
+    target = importlib.import_module("documents")
+    for name in renderer.split("."):
+        target = getattr(target, name)
+    return target(*args)
@@ -0,0 +1,699 @@
+"""Markdown parsing and PDF rendering for StudyBuddy exports.
+
+Nothing here imports Streamlit, so the export pool's worker processes can load
+this module without running the app's page code.
+"""
+import re
+import html
+import os
+import time
+import threading
+import hashlib
+import unicodedata
+from functools import lru_cache
+from contextlib import closing
+from typing import List, Dict, Tuple, Optional, Iterator
+from fpdf import FPDF
+from fontTools import subset as font_subset
+from fontTools.ttLib import TTFont
+
+from config import AppConfig
+
+
+# ============================================
+# PDF TEXT TRANSLITERATION
+# ============================================
+class _LatinFallbackTable(dict):
+    """str.translate table that works out a latin-1 stand-in for unknown code points once, then remembers it"""
+    def __missing__(self, codepoint: int) -> str:
+        char = chr(codepoint)
+        if char.isalpha() or char.isdigit():
+            # Strip accents and compatibility forms (e.g. 'ā' -> 'a', '⁴' -> '4')
+            replacement = unicodedata.normalize("NFKD", char).encode("ascii", "ignore").decode("ascii")
+            if not replacement and char.isdigit():
+                replacement = str(unicodedata.digit(char, "?"))
+            replacement = replacement or "?"
+        else:
+            replacement = " "
+        self[codepoint] = replacement
+        return replacement
+
+
+class PDFText:
+    """Single-pass transliteration of generated text into the latin-1 range the core PDF fonts support"""
+    REPLACEMENTS = {
+        # Quotes and apostrophes
+        "‘": "'", "’": "'", "“": '"', "”": '"',
+        # Dashes
+        '–': '-', '—': '-', 
+        # Ellipsis
+        '…': '...',
+        # Currency symbols
+        '€': 'EUR', '£': 'GBP', '¥': 'JPY', 
+        # Copyright and trademark
+        '©': '(c)', '®': '(r)', '™': '(tm)',
+        # Mathematical symbols
+        '°': ' degrees', '±': '+/-', '×': 'x', '÷': '/',
+        '≤': '<=', '≥': '>=', '≠': '!=', '≈': '~=',
+        '∞': 'infinity', '√': 'sqrt', '∑': 'sum',
+        # Bullets and arrows
+        '•': '-', '◦': '-', '▪': '-', '▫': '-',
+        '→': '->', '←': '<-', '↑': '^', '↓': 'v',
+        '⇒': '=>', '⇐': '<=',
+        # Greek letters (commonly used in math/science)
+        'α': 'alpha', 'β': 'beta', 'γ': 'gamma', 'δ': 'delta',
+        'ε': 'epsilon', 'ζ': 'zeta', 'η': 'eta', 'θ': 'theta',
+        'ι': 'iota', 'κ': 'kappa', 'λ': 'lambda', 'μ': 'mu',
+        'ν': 'nu', 'ξ': 'xi', 'ο': 'omicron', 'π': 'pi',
+        'ρ': 'rho', 'σ': 'sigma', 'τ': 'tau', 'υ': 'upsilon',
+        'φ': 'phi', 'χ': 'chi', 'ψ': 'psi', 'ω': 'omega',
+        # Capital Greek letters
+        'Α': 'Alpha', 'Β': 'Beta', 'Γ': 'Gamma', 'Δ': 'Delta',
+        'Ε': 'Epsilon', 'Ζ': 'Zeta', 'Η': 'Eta', 'Θ': 'Theta',
+        'Ι': 'Iota', 'Κ': 'Kappa', 'Λ': 'Lambda', 'Μ': 'Mu',
+        'Ν': 'Nu', 'Ξ': 'Xi', 'Ο': 'Omicron', 'Π': 'Pi',
+        'Ρ': 'Rho', 'Σ': 'Sigma', 'Τ': 'Tau', 'Υ': 'Upsilon',
+        'Φ': 'Phi', 'Χ': 'Chi', 'Ψ': 'Psi', 'Ω': 'Omega',
+        # Fractions
+        '½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4',
+        # Superscripts and subscripts (basic ones)
+        '²': '^2', '³': '^3', '¹': '^1', '⁰': '^0',
+        # Other common symbols
+        '§': 'section', '¶': 'paragraph', '†': '+', '‡': '++',
+        '‰': 'per mille', '‱': 'per ten thousand',
+    }
+
+    # Latin-1 maps to itself so mixed text never falls through to __missing__ for ordinary characters
+    TABLE = _LatinFallbackTable({codepoint: codepoint for codepoint in range(256)})
+    TABLE.update(str.maketrans(REPLACEMENTS))
+
+    @staticmethod
+    def clean(text: str) -> str:
+        """Translate text into latin-1 in one pass over the string"""
+        if not text:
+            return ""
+        if text.isascii():
+            return text
+        return text.translate(PDFText.TABLE)
+
+# ============================================
+# PDF FONTS
+# ============================================
+class _FontCoverageTable(dict):
+    """str.translate table that keeps characters the embedded font can draw and transliterates the rest"""
+    def __init__(self, cmap: Dict[int, str]):
+        super().__init__()
+        self.cmap = cmap
+
+    def __missing__(self, codepoint: int):
+        replacement = codepoint if codepoint < 32 or codepoint in self.cmap else PDFText.TABLE[codepoint]
+        self[codepoint] = replacement
+        return replacement
+
+
+class PDFFontCache:
+    """Unicode TTF fonts located and cut down once per process, then registered on each PDF with add_font.
+
+    Only the cut-down working copies are reused. add_font still parses the
+    working copy for every document, because fpdf2 keeps each document's
+    glyph subset in the parsed font. "parses" counts those per-document loads.
+    """
+    def __init__(self, family: str, font_files: Dict[str, str]):
+        self.family = family
+        self.font_files = font_files
+        self._working_paths = {}
+        self._coverage = None
+        self._lock = threading.Lock()
+        self.stats = {"subset_builds": 0, "parses": 0, "total_parse_time": 0.0}
+
+    @property
+    def available(self) -> bool:
+        return "" in self.font_files
+
+    @staticmethod
+    def find_font_files() -> Dict[str, str]:
+        """Look for each style in the app's font folder first, then in the usual system folders"""
+        font_files = {}
+        for style, file_name in AppConfig.PDF_FONT_FILES.items():
+            for folder in (AppConfig.PDF_FONT_DIR,) + AppConfig.PDF_SYSTEM_FONT_DIRS:
+                path = os.path.join(folder, file_name)
+                if os.path.isfile(path):
+                    font_files[style] = path
+                    break
+        return font_files
+
+    def _working_font(self, path: str) -> str:
+        """Copy of the font cut down to PDF_FONT_UNICODE_RANGES, built once and kept in the cache folder"""
+        ranges = AppConfig.PDF_FONT_UNICODE_RANGES
+        stat = os.stat(path)
+        digest = hashlib.sha256(repr((os.path.abspath(path), stat.st_size, stat.st_mtime_ns, ranges)).encode("utf-8"))
+        name = os.path.splitext(os.path.basename(path))[0]
+        subset_path = os.path.join(AppConfig.CACHE_DIR, "fonts", f"{name}-{digest.hexdigest()[:16]}.ttf")
+        if os.path.isfile(subset_path):
+            return subset_path
+        # A few hundred glyphs instead of thousands keeps parsing and per-export subsetting cheap
+        options = font_subset.Options(notdef_outline=True, recommended_glyphs=True, glyph_names=True, layout_features=[])
+        options.drop_tables += ["FFTM", "GSUB", "GPOS", "GDEF"]
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(unicodes=[codepoint for first, last in ranges for codepoint in range(first, last + 1)])
+        font = TTFont(path)
+        subsetter.subset(font)
+        try:
+            os.makedirs(os.path.dirname(subset_path), exist_ok=True)
+            temp_path = f"{subset_path}.{os.getpid()}.tmp"
+            font.save(temp_path)
+            os.replace(temp_path, subset_path)
+        except OSError:
+            return path
+        finally:
+            font.close()
+        self.stats["subset_builds"] += 1
+        return subset_path
+
+    def _working_path(self, style: str) -> str:
+        """Working copy of the font file for one style, built the first time it is asked for"""
+        # Styles without their own file (e.g. no oblique installed) reuse the regular face
+        path = self.font_files.get(style, self.font_files[""])
+        with self._lock:
+            if path not in self._working_paths:
+                self._working_paths[path] = self._working_font(path)
+            return self._working_paths[path]
+
+    def install(self, pdf: FPDF, style: str = ""):
+        """Register one style of the family on a document the first time the document uses it"""
+        # Same normalisation as FPDF.set_font: sorted letters, underline/strike-through are not faces
+        style = "".join(sorted(getattr(style, "style", style).upper())).replace("U", "").replace("S", "")
+        if f"{self.family.lower()}{style}" in pdf.fonts:
+            return
+        working_path = self._working_path(style)
+        start_time = time.perf_counter()
+        pdf.add_font(self.family, style, working_path)
+        with self._lock:
+            self.stats["parses"] += 1
+            self.stats["total_parse_time"] += time.perf_counter() - start_time
+
+    def clean(self, text: str) -> str:
+        """Transliterate only the characters the embedded font has no glyph for"""
+        if not text:
+            return ""
+        if text.isascii():
+            return text
+        if self._coverage is None:
+            with closing(TTFont(self._working_path(""), lazy=True)) as font:
+                self._coverage = _FontCoverageTable(font.getBestCmap())
+        return text.translate(self._coverage)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "family": self.family if self.available else None, "styles": sorted(self.font_files)}
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def instance() -> "PDFFontCache":
+        """Font cache shared by every export in this process"""
+        return PDFFontCache(AppConfig.PDF_FONT_FAMILY, PDFFontCache.find_font_files())
+
+# ============================================
+# MARKDOWN DOCUMENTS
+# ============================================
+class MarkdownBlock:
+    """One block-level element of a parsed markdown document"""
+    def __init__(self, kind: str, level: int = 0, spans: Optional[List[Tuple[str, str]]] = None,
+                 items: Optional[List] = None, rows: Optional[List] = None, text: str = "", language: str = ""):
+        self.kind = kind          # heading, paragraph, quote, list, code, table or rule
+        self.level = level        # Heading level
+        self.spans = spans or []  # (text, style) runs; style is "", "B", "I", "BI" or "code"
+        self.items = items or []  # List items as (marker, depth, spans)
+        self.rows = rows or []    # Table rows of cells, each a list of spans; the first row is the header
+        self.text = text          # Raw contents of a code block
+        self.language = language
+
+
+class MarkdownDocument:
+    """Generated markdown parsed once into blocks and inline spans, walked by every exporter"""
+    HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+    LIST_ITEM = re.compile(r"^(\s*)([-*+•]|\d+[.)])\s+(.*)$")
+    RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+    TABLE_DIVIDER = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+    INLINE = re.compile(
+        r"`([^`]+)`"
+        r"|\*\*\*(.+?)\*\*\*"
+        r"|\*\*(.+?)\*\*"
+        r"|__(.+?)__"
+        r"|(?<![\w*])\*(?![\s*])(.+?)(?<![\s*])\*(?![\w*])"
+        r"|(?<!\w)_(?![\s_])(.+?)(?<![\s_])_(?!\w)"
+    )
+
+    def __init__(self, blocks: List[MarkdownBlock]):
+        self.blocks = blocks
+
+    @staticmethod
+    def parse_inline(text: str) -> List[Tuple[str, str]]:
+        """Split a line of markdown into (text, style) runs"""
+        spans = []
+        position = 0
+        for match in MarkdownDocument.INLINE.finditer(text):
+            if match.start() > position:
+                spans.append((text[position:match.start()], ""))
+            code, bold_italic, bold, bold_alt, italic, italic_alt = match.groups()
+            if code is not None:
+                spans.append((code, "code"))
+            elif bold_italic is not None:
+                spans.append((bold_italic, "BI"))
+            elif bold is not None or bold_alt is not None:
+                spans.append((bold if bold is not None else bold_alt, "B"))
+            else:
+                spans.append((italic if italic is not None else italic_alt, "I"))
+            position = match.end()
+        if position < len(text):
+            spans.append((text[position:], ""))
+        return spans
+
+    @staticmethod
+    def _table_cells(line: str) -> List[str]:
+        line = line.strip()
+        if line.startswith("|"):
+            line = line[1:]
+        if line.endswith("|"):
+            line = line[:-1]
+        return [cell.strip() for cell in line.split("|")]
+
+    @staticmethod
+    def _close(block: MarkdownBlock) -> MarkdownBlock:
+        """Turn the raw text collected for a list, quote or paragraph into inline spans"""
+        parse_inline = MarkdownDocument.parse_inline
+        if block.kind == "list":
+            block.items = [(marker, depth, parse_inline(item_text)) for marker, depth, item_text in block.items]
+        else:
+            block.spans, block.text = parse_inline(block.text), ""
+        return block
+
+    @staticmethod
+    def iter_blocks(text: str) -> Iterator[MarkdownBlock]:
+        """Parse headings, lists, quotes, code blocks, tables and emphasis in a single pass,
+        yielding each block as soon as it is complete so long documents can be streamed"""
+        close = MarkdownDocument._close
+        parse_inline = MarkdownDocument.parse_inline
+        lines = (text or "").replace("\r\n", "\n").split("\n")
+        pending = None  # Paragraph, quote or list that the next line may still extend
+        in_item = False
+
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            stripped = line.strip()
+
+            if stripped.startswith("```"):
+                if pending is not None:
+                    yield close(pending)
+                    pending = None
+                code = []
+                i += 1
+                while i < len(lines) and not lines[i].strip().startswith("```"):
+                    code.append(lines[i])
+                    i += 1
+                yield MarkdownBlock("code", text="\n".join(code), language=stripped[3:].strip())
+                in_item = False
+                i += 1
+                continue
+
+            if not stripped:
+                # Items separated only by blank lines stay in the same list
+                if pending is not None and pending.kind != "list":
+                    yield close(pending)
+                    pending = None
+                in_item = False
+                i += 1
+                continue
+
+            heading = MarkdownDocument.HEADING.match(stripped)
+            item = None if heading else MarkdownDocument.LIST_ITEM.match(line)
+            is_table = stripped.startswith("|") and i + 1 < len(lines) and MarkdownDocument.TABLE_DIVIDER.match(lines[i + 1])
+            if heading or is_table or MarkdownDocument.RULE.match(stripped):
+                if pending is not None:
+                    yield close(pending)
+                    pending = None
+                in_item = False
+                if heading:
+                    yield MarkdownBlock("heading", level=len(heading.group(1)), spans=parse_inline(heading.group(2)))
+                elif is_table:
+                    header = MarkdownDocument._table_cells(stripped)
+                    rows = [header]
+                    i += 2
+                    while i < len(lines) and lines[i].strip().startswith("|"):
+                        cells = MarkdownDocument._table_cells(lines[i])
+                        rows.append((cells + [""] * len(header))[:len(header)])
+                        i += 1
+                    yield MarkdownBlock("table", rows=[[parse_inline(cell) for cell in row] for row in rows])
+                    continue
+                else:
+                    yield MarkdownBlock("rule")
+            elif item:
+                marker, depth = item.group(2), len(item.group(1).expandtabs(4)) // 2
+                # A change of numbering style at the top level starts a new list
+                if (pending is None or pending.kind != "list"
+                        or (depth == 0 and pending.items[0][0][0].isdigit() != marker[0].isdigit())):
+                    if pending is not None:
+                        yield close(pending)
+                    pending = MarkdownBlock("list")
+                pending.items.append([marker, depth, item.group(3)])
+                in_item = True
+            elif in_item and line[:1].isspace():
+                pending.items[-1][2] += " " + stripped
+            else:
+                kind = "quote" if stripped.startswith(">") else "paragraph"
+                line_text = stripped.lstrip(">").strip() if kind == "quote" else stripped
+                if pending is not None and pending.kind == kind:
+                    pending.text += " " + line_text
+                else:
+                    if pending is not None:
+                        yield close(pending)
+                    pending = MarkdownBlock(kind, text=line_text)
+                in_item = False
+            i += 1
+
+        if pending is not None:
+            yield close(pending)
+
+    @staticmethod
+    def parse(text: str) -> "MarkdownDocument":
+        """Parse a whole document into its list of blocks"""
+        return MarkdownDocument(list(MarkdownDocument.iter_blocks(text)))
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def from_text(text: str) -> "MarkdownDocument":
+        """Parsed document for a generated text, shared by every export, rerun and session"""
+        return MarkdownDocument.parse(text)
+
+    @staticmethod
+    def split_sections(text: str, max_chars: int) -> List[str]:
+        """Cut markdown into sections at headings, then at blank lines wherever a section exceeds max_chars.
+
+        Headings inside fenced code do not start a section, and very short
+        sections are folded into the one before them.
+        """
+        sections, lines, in_code = [], [], False
+        for line in text.splitlines():
+            if line.lstrip().startswith("```"):
+                in_code = not in_code
+            if not in_code and MarkdownDocument.HEADING.match(line) and any(part.strip() for part in lines):
+                sections.append("\n".join(lines).strip())
+                lines = []
+            lines.append(line)
+        if any(part.strip() for part in lines):
+            sections.append("\n".join(lines).strip())
+
+        pieces = []
+        for section in sections:
+            current = ""
+            for paragraph in re.split(r"\n\s*\n", section):
+                for start in range(0, len(paragraph), max_chars):
+                    chunk = paragraph[start:start + max_chars]
+                    if current and len(current) + len(chunk) + 2 > max_chars:
+                        pieces.append(current)
+                        current = ""
+                    current = f"{current}\n\n{chunk}" if current else chunk
+            if current:
+                pieces.append(current)
+
+        merged = []
+        for piece in pieces:
+            if merged and len(piece) < max_chars // 5 and len(merged[-1]) + len(piece) + 2 <= max_chars:
+                merged[-1] = f"{merged[-1]}\n\n{piece}"
+            else:
+                merged.append(piece)
+        return merged
+
+
+class MarkdownExport:
+    """HTML and plain-text renderings of a parsed markdown document"""
+    HTML_TAGS = {"B": ("<strong>", "</strong>"), "I": ("<em>", "</em>"), "BI": ("<strong><em>", "</em></strong>"),
+                 "code": ("<code>", "</code>")}
+
+    @staticmethod
+    def plain(spans: List[Tuple[str, str]]) -> str:
+        return "".join(text for text, _ in spans)
+
+    @staticmethod
+    def inline_html(spans: List[Tuple[str, str]]) -> str:
+        parts = []
+        for text, style in spans:
+            opening, closing = MarkdownExport.HTML_TAGS.get(style, ("", ""))
+            parts.append(f"{opening}{html.escape(text)}{closing}")
+        return "".join(parts)
+
+    @staticmethod
+    def to_html(document: MarkdownDocument) -> str:
+        """HTML fragment for the document body"""
+        inline = MarkdownExport.inline_html
+        parts = []
+        for block in document.blocks:
+            if block.kind == "heading":
+                parts.append(f"<h{block.level}>{inline(block.spans)}</h{block.level}>")
+            elif block.kind == "paragraph":
+                parts.append(f"<p>{inline(block.spans)}</p>")
+            elif block.kind == "quote":
+                parts.append(f"<blockquote>{inline(block.spans)}</blockquote>")
+            elif block.kind == "rule":
+                parts.append("<hr>")
+            elif block.kind == "code":
+                language = f' class="language-{html.escape(block.language)}"' if block.language else ""
+                # Character references stop blank lines in the code from ending an enclosing HTML block
+                code = html.escape(block.text).replace("\n", "&#10;")
+                parts.append(f"<pre><code{language}>{code}</code></pre>")
+            elif block.kind == "list":
+                tag = "ol" if block.items[0][0][0].isdigit() else "ul"
+                items = "".join(
+                    f'<li style="margin-left: {depth * 1.5}em">{inline(spans)}</li>' if depth else f"<li>{inline(spans)}</li>"
+                    for _, depth, spans in block.items
+                )
+                parts.append(f"<{tag}>{items}</{tag}>")
+            elif block.kind == "table":
+                header = "".join(f"<th>{inline(cell)}</th>" for cell in block.rows[0])
+                body = "".join(
+                    "<tr>" + "".join(f"<td>{inline(cell)}</td>" for cell in row) + "</tr>"
+                    for row in block.rows[1:]
+                )
+                parts.append(f"<table><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table>")
+        return "\n".join(parts)
+
+    @staticmethod
+    def to_html_page(document: MarkdownDocument, title: str) -> str:
+        """Standalone HTML file with the app's colours"""
+        return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>
+body {{ font-family: Inter, Arial, sans-serif; max-width: 800px; margin: 2rem auto; color: #1F2937; line-height: 1.6; }}
+h1, h2, h3 {{ color: {AppConfig.PRIMARY_COLOR}; }}
+pre, code {{ background: {AppConfig.LIGHT_GRAY}; border-radius: 4px; }}
+pre {{ padding: 0.75rem; overflow-x: auto; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #D1D5DB; padding: 0.25rem 0.5rem; }}
+blockquote {{ border-left: 4px solid {AppConfig.PRIMARY_COLOR}; margin-left: 0; padding-left: 1rem; color: {AppConfig.DARK_GRAY}; }}
+footer {{ margin-top: 3rem; font-size: 0.8rem; color: #B4B4B4; text-align: center; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+{MarkdownExport.to_html(document)}
+<footer>Developed by Faizan Mustafa | Uniquery AI</footer>
+</body>
+</html>
+"""
+
+    @staticmethod
+    def to_text(document: MarkdownDocument) -> str:
+        """Plain text with markup removed and headings underlined"""
+        plain = MarkdownExport.plain
+        parts = []
+        for block in document.blocks:
+            if block.kind == "heading":
+                text = plain(block.spans)
+                underline = {1: "=", 2: "-"}.get(block.level)
+                parts.append(f"{text}\n{underline * len(text)}" if underline else text)
+            elif block.kind == "paragraph":
+                parts.append(plain(block.spans))
+            elif block.kind == "quote":
+                parts.append(f"> {plain(block.spans)}")
+            elif block.kind == "rule":
+                parts.append("-" * 40)
+            elif block.kind == "code":
+                parts.append("\n".join(f"    {line}" for line in block.text.split("\n")))
+            elif block.kind == "list":
+                parts.append("\n".join(
+                    f"{'  ' * depth}{marker if marker[0].isdigit() else '-'} {plain(spans)}"
+                    for marker, depth, spans in block.items
+                ))
+            elif block.kind == "table":
+                parts.append("\n".join(" | ".join(plain(cell) for cell in row) for row in block.rows))
+        return "\n\n".join(parts) + "\n"
+
+# ============================================
+# PDF RENDERING
+# ============================================
+class PDFRenderer:
+    """StudyBuddy PDF exports; run in the export pool's worker processes, or inline when it is disabled"""
+    @staticmethod
+    def render_pdf_file(path: str, content: str, topic: str, material_type: str) -> bool:
+        """Write the PDF to path; the export pool's target for materials too long for the in-memory export cache"""
+        with open(path, "wb") as stream:
+            return PDFRenderer.write_pdf(stream, content, topic, material_type)
+
+    @staticmethod
+    def generate_pdf_bytes(content: str, topic: str, material_type: str, unicode_font: Optional[bool] = None):
+        """Generate PDF bytes with proper formatting and watermark on every page"""
+        return PDFRenderer._render_pdf(content, topic, material_type, unicode_font)
+
+    @staticmethod
+    def write_pdf(stream, content: str, topic: str, material_type: str, unicode_font: Optional[bool] = None) -> bool:
+        """Write the PDF into a binary stream instead of returning its bytes"""
+        return PDFRenderer._render_pdf(content, topic, material_type, unicode_font, stream) is not None
+
+    @staticmethod
+    def _render_pdf(content: str, topic: str, material_type: str, unicode_font: Optional[bool] = None, stream=None):
+        """Lay out the PDF, then either return its bytes or write it to stream"""
+        # Embed the Unicode font when one is installed, otherwise fall back to latin-1 core fonts
+        if unicode_font is None:
+            unicode_font = AppConfig.PDF_UNICODE_FONTS
+        fonts = PDFFontCache.instance() if unicode_font else None
+        if fonts is not None and fonts.available:
+            font_family = fonts.family
+            clean_text = fonts.clean
+        else:
+            fonts = None
+            font_family = "Arial"
+            clean_text = PDFText.clean
+        
+        class PDF(FPDF):
+            def set_font(self, family=None, style="", size=0):
+                # Only the styles a document actually uses get embedded
+                if fonts is not None and (family or self.font_family).lower() == font_family.lower():
+                    fonts.install(self, style)
+                super().set_font(family, style, size)
+            
+            def footer(self):
+                # Position at 1.5 cm from bottom
+                self.set_y(-15)
+                # Set font
+                self.set_font(font_family, 'I', 8)
+                # Set text color to light gray
+                self.set_text_color(180, 180, 180)
+                # Add watermark
+                self.cell(0, 10, 'Developed by Faizan Mustafa | Uniquery AI', 0, 0, 'C')
+        
+        # Create PDF with custom class
+        pdf = PDF()
+        pdf.add_page()
+        pdf.set_auto_page_break(auto=True, margin=25)  # Extra margin for footer
+        
+        # Set main font for the document
+        pdf.set_font(font_family, size=12)
+        
+        # Add title
+        pdf.set_font(font_family, 'B', 16)
+        # Clean topic and material_type for PDF compatibility
+        clean_topic = clean_text(topic)
+        clean_material_type = clean_text(material_type)
+        pdf.cell(0, 10, txt=f"{clean_material_type}: {clean_topic}", ln=1, align='C')
+        pdf.ln(10)
+        
+        # Process content and add to PDF
+        pdf.set_font(font_family, size=12)
+        code_family = font_family if fonts is not None else "Courier"
+        
+        def write_spans(spans, size, indent=0):
+            # write() wraps back to the left margin, so move it in for hanging indents
+            left_margin = pdf.l_margin
+            pdf.set_left_margin(left_margin + indent)
+            for text, style in spans:
+                if style == "code":
+                    pdf.set_font(code_family, size=size)
+                else:
+                    pdf.set_font(font_family, style, size)
+                pdf.write(6, clean_text(text))
+            pdf.set_font(font_family, size=12)
+            pdf.set_left_margin(left_margin)
+            pdf.ln(6)
+        
+        # Walk the parsed document instead of re-parsing the markdown here
+        for block in MarkdownDocument.from_text(content).blocks:
+            # Check if we need a new page
+            if pdf.y + 20 > pdf.page_break_trigger:
+                pdf.add_page()
+            
+            if block.kind == "heading":
+                heading = clean_text(MarkdownExport.plain(block.spans))
+                if block.level == 1:  # Main heading
+                    pdf.set_font(font_family, 'B', 14)
+                    pdf.cell(0, 10, txt=heading, ln=1)
+                    pdf.set_font(font_family, size=12)
+                    pdf.ln(3)
+                elif block.level == 2:  # Subheading
+                    pdf.set_font(font_family, 'B', 12)
+                    pdf.cell(0, 8, txt=heading, ln=1)
+                    pdf.set_font(font_family, size=12)
+                    pdf.ln(2)
+                else:  # Sub-subheading
+                    pdf.set_font(font_family, 'I', 12)
+                    pdf.cell(0, 8, txt=heading, ln=1)
+                    pdf.set_font(font_family, size=12)
+                    pdf.ln(2)
+            elif block.kind == "list":  # Bullet points and numbered lists
+                for marker, depth, spans in block.items:
+                    pdf.set_x(pdf.l_margin + depth * 5)
+                    marker = marker if marker[0].isdigit() else '-'  # Use simple hyphen instead of bullet
+                    pdf.cell(10, 6, txt=marker, ln=0)
+                    write_spans(spans, 12, depth * 5 + 10)
+                    pdf.ln(1)
+                pdf.ln(2)
+            elif block.kind == "code":
+                pdf.set_font(code_family, size=10)
+                pdf.set_fill_color(243, 244, 246)
+                pdf.multi_cell(0, 5, txt=clean_text(block.text), fill=True, align='L')
+                pdf.set_font(font_family, size=12)
+                pdf.ln(3)
+            elif block.kind == "table":
+                pdf.set_font(font_family, size=10)
+                with pdf.table(text_align="LEFT", line_height=6) as table:
+                    for row in block.rows:
+                        table_row = table.row()
+                        for cell in row:
+                            table_row.cell(clean_text(MarkdownExport.plain(cell)))
+                pdf.set_font(font_family, size=12)
+                pdf.ln(3)
+            elif block.kind == "rule":
+                pdf.line(pdf.l_margin, pdf.y + 2, pdf.w - pdf.r_margin, pdf.y + 2)
+                pdf.ln(6)
+            elif block.kind == "quote":
+                write_spans([(text, style or "I") for text, style in block.spans], 12, 10)
+                pdf.ln(2)
+            elif all(style == "" for _, style in block.spans):
+                # Regular paragraph
+                pdf.multi_cell(0, 6, txt=clean_text(MarkdownExport.plain(block.spans)), align='J')
+                pdf.ln(4)
+            else:
+                # Paragraph with bold / italic runs
+                write_spans(block.spans, 12)
+                pdf.ln(2)
+        
+        if stream is not None:
+            # fpdf2 assembles the whole file in memory before writing it, so this saves no memory
+            # while rendering; it only keeps large PDFs out of the in-memory export cache
+            pdf.output(stream)
+            return True
+        
+        # Get PDF bytes - handle both string and bytearray returns
+        pdf_output = pdf.output(dest='S')
+        
+        # Check if output is string or bytearray and handle accordingly
+        if isinstance(pdf_output, str):
+            return pdf_output.encode('latin-1')
+        elif isinstance(pdf_output, (bytes, bytearray)):
+            return bytes(pdf_output)
+        else:
+            # Fallback for other types
+            return bytes(pdf_output)